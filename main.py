@@ -1,12 +1,19 @@
 import os
 import logging
 import asyncio
-from typing import Dict, List, Optional
+from typing import Callable, Dict, List, Optional
 from datetime import datetime, timedelta
-import json
+import orjson
+import re
+import hashlib
+import time
 import aiohttp
+import numpy as np
+import redis.asyncio as aioredis
+from rapidfuzz import fuzz, process
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand
 from telegram.ext import (
+    AIORateLimiter,
     Application,
     CommandHandler,
     MessageHandler,
@@ -14,9 +21,10 @@ from telegram.ext import (
     ContextTypes,
     filters
 )
-from telegram.constants import ParseMode
-import sqlite3
-from contextlib import asynccontextmanager
+from telegram.constants import ChatType, ParseMode
+from telegram.error import TelegramError
+import aiosqlite
+from contextlib import asynccontextmanager, suppress
 from dotenv import load_dotenv
 
 # Загружаем переменные окружения из .env файла
@@ -29,6 +37,189 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# SQL запросы вынесены в константы: одна и та же строка при каждом вызове
+# позволяет sqlite3 брать уже подготовленный запрос из кэша соединения
+SQL_UPSERT_USER = '''
+    INSERT INTO users (id, username, first_name, last_name)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(id) DO UPDATE SET
+        username = excluded.username,
+        first_name = excluded.first_name,
+        last_name = excluded.last_name,
+        last_activity = CURRENT_TIMESTAMP
+'''
+SQL_INSERT_TICKET = '''
+    INSERT INTO tickets (user_id, message, category)
+    VALUES (?, ?, ?)
+'''
+SQL_STATS = '''
+    SELECT
+        (SELECT COUNT(*) FROM users),
+        (SELECT COUNT(*) FROM tickets WHERE status = 'open'),
+        (SELECT COUNT(*) FROM tickets WHERE created_at >= date('now'))
+'''
+
+class SemanticCache:
+    """Кэш ответов Gemini: точное совпадение по хэшу и семантическое по эмбеддингам"""
+
+    REDIS_PREFIX = 'dostyqtv:llm_cache:'
+    REDIS_LOAD_BATCH = 500
+
+    def __init__(self, redis_url: Optional[str] = None, threshold: float = 0.92,
+                 ttl: int = 3600, max_entries: int = 1000):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # hash -> (ответ, время истечения)
+        self._entries: Dict[str, tuple] = {}
+        # Матрица эмбеддингов на max_entries строк выделяется один раз;
+        # свободные строки заполнены нулями и никогда не проходят порог
+        self._matrix: Optional[np.ndarray] = None
+        self._row_keys: List[Optional[str]] = []
+        self._rows: Dict[str, int] = {}
+        self._free_rows: List[int] = []
+        self._redis = aioredis.from_url(redis_url) if redis_url else None
+
+    @staticmethod
+    def make_key(user_message: str) -> str:
+        """Хэш нормализованного запроса"""
+        return hashlib.sha256(user_message.lower().strip().encode('utf-8')).hexdigest()
+
+    async def get(self, key: str) -> Optional[str]:
+        """Поиск точного совпадения в памяти, затем в Redis"""
+        self._evict_expired()
+        entry = self._entries.get(key)
+        if entry:
+            return entry[0]
+
+        if not self._redis:
+            return None
+
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                raw, pttl = await pipe.get(self.REDIS_PREFIX + key).pttl(self.REDIS_PREFIX + key).execute()
+        except Exception as e:
+            logger.error(f"Redis cache read error: {e}")
+            return None
+
+        ttl = self._remaining_ttl(pttl)
+        if not raw or ttl is None:
+            return None
+
+        embedding, response = self._decode(raw)
+        self._store(key, embedding, response, ttl)
+        return response
+
+    def get_similar(self, embedding: np.ndarray) -> Optional[str]:
+        """Поиск семантически близкого запроса по косинусной близости"""
+        self._evict_expired()
+        if not self._rows or embedding.shape[0] != self._matrix.shape[1]:
+            return None
+
+        scores = self._matrix @ embedding
+        best = int(np.argmax(scores))
+        if scores[best] > self.threshold:
+            return self._entries[self._row_keys[best]][0]
+        return None
+
+    async def set(self, key: str, embedding: Optional[np.ndarray], response: str):
+        """Сохранение ответа в памяти и в Redis"""
+        self._store(key, embedding, response)
+
+        if not self._redis:
+            return
+
+        payload = {
+            'embedding': embedding,
+            'response': response
+        }
+        try:
+            await self._redis.set(self.REDIS_PREFIX + key, orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY), ex=self.ttl)
+        except Exception as e:
+            logger.error(f"Redis cache write error: {e}")
+
+    async def load(self):
+        """Загрузка сохраненных ответов из Redis при запуске"""
+        if not self._redis:
+            return
+
+        try:
+            redis_keys = [redis_key async for redis_key in self._redis.scan_iter(match=f'{self.REDIS_PREFIX}*')]
+            # Читаем пачками: один MGET и PTTL ключей пачки за один проход по сети
+            for start in range(0, len(redis_keys), self.REDIS_LOAD_BATCH):
+                batch = redis_keys[start:start + self.REDIS_LOAD_BATCH]
+                async with self._redis.pipeline(transaction=False) as pipe:
+                    pipe.mget(batch)
+                    for redis_key in batch:
+                        pipe.pttl(redis_key)
+                    values, *pttls = await pipe.execute()
+
+                for redis_key, raw, pttl in zip(batch, values, pttls):
+                    ttl = self._remaining_ttl(pttl)
+                    if raw and ttl is not None:
+                        key = redis_key.decode()[len(self.REDIS_PREFIX):]
+                        self._store(key, *self._decode(raw), ttl)
+        except Exception as e:
+            logger.error(f"Redis cache load error: {e}")
+
+    async def close(self):
+        if self._redis:
+            await self._redis.aclose()
+
+    @staticmethod
+    def _decode(raw: bytes) -> tuple:
+        payload = orjson.loads(raw)
+        embedding = payload['embedding']
+        if embedding is not None:
+            embedding = np.asarray(embedding, dtype=np.float32)
+        return embedding, payload['response']
+
+    def _remaining_ttl(self, pttl: int) -> Optional[float]:
+        """Оставшийся срок жизни ключа Redis в секундах, None если ключ уже истек"""
+        if pttl == -1:
+            # Ключ без срока жизни
+            return self.ttl
+        if pttl <= 0:
+            return None
+        return pttl / 1000
+
+    def _store(self, key: str, embedding: Optional[np.ndarray], response: str,
+               ttl: Optional[float] = None):
+        if key in self._entries:
+            self._drop(key)
+        elif len(self._entries) >= self.max_entries:
+            # Вытесняем самую старую запись
+            self._drop(next(iter(self._entries)))
+        self._entries[key] = (response, time.monotonic() + (self.ttl if ttl is None else ttl))
+
+        if embedding is None:
+            return
+        if self._matrix is None:
+            self._matrix = np.zeros((self.max_entries, embedding.shape[0]), dtype=np.float32)
+            self._row_keys = [None] * self.max_entries
+            self._free_rows = list(range(self.max_entries - 1, -1, -1))
+        if embedding.shape[0] != self._matrix.shape[1]:
+            return
+
+        row = self._free_rows.pop()
+        self._matrix[row] = embedding
+        self._row_keys[row] = key
+        self._rows[key] = row
+
+    def _drop(self, key: str):
+        del self._entries[key]
+        row = self._rows.pop(key, None)
+        if row is not None:
+            self._matrix[row] = 0
+            self._row_keys[row] = None
+            self._free_rows.append(row)
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        for key in [key for key, entry in self._entries.items() if entry[1] <= now]:
+            self._drop(key)
+
+
 class DostyqTVBot:
     def __init__(self):
         # Конфигурация из .env файла
@@ -36,6 +227,25 @@ class DostyqTVBot:
         self.GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
         self.ADMIN_IDS = [int(x) for x in os.getenv('ADMIN_IDS', '').split(',') if x]
 
+        # Кэш ответов AI (Redis опционален)
+        self.cache = SemanticCache(redis_url=os.getenv('REDIS_URL'))
+
+        # Общая HTTP сессия для запросов к Gemini, создается в post_init
+        self._session: Optional[aiohttp.ClientSession] = None
+
+        # Постоянное соединение с базой данных, открывается в post_init
+        self._db: Optional[aiosqlite.Connection] = None
+
+        # Очередь записи пользователей: сохраняются пачками в фоне
+        self.WRITE_BATCH_SIZE = 100
+        self.WRITE_BATCH_INTERVAL = 0.2
+        self._write_queue: asyncio.Queue = asyncio.Queue()
+        self._writer_task: Optional[asyncio.Task] = None
+
+        # Минимальный интервал между обновлениями сообщения при потоковом ответе:
+        # правки расходуют общий лимит Telegram в 30 запросов в секунду
+        self.STREAM_EDIT_INTERVAL = 3.0
+
         # База знаний DostyqTV
         self.knowledge_base = {
             'программы': {
@@ -66,13 +276,118 @@ class DostyqTVBot:
             'Реклама на канале': 'По вопросам размещения рекламы: reklama@dostyq.tv или +7 (727) 24-24-25'
         }
 
+        # Системный промпт не меняется во время работы, поэтому собираем его один раз
+        self._system_prompt = f"""
+            Ты - помощник службы поддержки телеканала DostyqTV. Отвечай на казахском или русском языке в зависимости от языка вопроса.
+
+            База знаний:
+            {orjson.dumps(self.knowledge_base, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode()}
+
+            FAQ:
+            {orjson.dumps(self.faq, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode()}
+
+            Правила:
+            1. Всегда будь вежливым и профессиональным.
+            2. Если не знаешь точного ответа, предложи обратиться в службу поддержки, указав контакты.
+            3. Используй эмодзи для улучшения восприятия.
+            4. Ответы должны быть краткими, но информативными.
+            5. При технических проблемах предлагай пошаговые решения.
+            """
+
+        # Резервные ответы: ключевые слова собраны в одно регулярное выражение на правило.
+        # Слова совпадают как подстроки (например, 'передач' находит 'передачи')
+        fallback_rules = [
+            (['программа', 'расписание', 'передач'],
+             "📺 Полное расписание программ доступно на сайте dostyq.tv в разделе 'Каталог'"),
+            (['качество', 'плохо', 'тормозит', 'зависает'],
+             "🔧 При проблемах с качеством, попробуйте перезагрузить приставку. Если не помогло, свяжитесь с поддержкой: +7 771 300 05 02, +7 702 300 05 01"),
+            (['настроить', 'канал', 'найти'],
+             "⚙️ Настройка канала DostyqTV:\n\n📍 Найдите нас на позиции 44 в кабельных сетях. Если не получается, обратитесь к вашему оператору кабельного ТВ."),
+            (['контакт', 'телефон', 'связаться'],
+             "📞 Контакты DostyqTV:\n\n☎️ Поддержка: +7 777 013 3812\n📧 Email: support@dostyq.tv\n🌐 Сайт: https://dostyq.tv"),
+            (['реклама', 'размещение'],
+             "📢 По вопросам размещения рекламы:\n\n📧 reklama@dostyq.tv\n☎️ +7 (727) 24-24-25")
+        ]
+        self._fallback_rules: List[tuple] = [
+            (re.compile('|'.join(map(re.escape, words))), response)
+            for words, response in fallback_rules
+        ]
+        self._fallback_default = "👋 Здравствуйте! Я помогу вам с вопросами по телеканалу DostyqTV.\n\n🔍 Используйте /help для просмотра доступных команд или просто опишите вашу проблему."
+
+        # Индекс готовых ответов по нормализованным вопросам FAQ. Ключи базы знаний сюда
+        # не входят: одиночные слова вроде 'качество' дали бы голые факты вместо помощи
+        self._exact_index: Dict[str, str] = {
+            self.normalize_query(question): answer for question, answer in self.faq.items()
+        }
+        self._exact_keys = list(self._exact_index)
+
+        # Готовые ответы отправляются без разметки: Markdown нужен только ответам Gemini
+        self._canned_responses = frozenset(
+            [response for _, response in fallback_rules]
+            + [self._fallback_default]
+            + list(self._exact_index.values())
+        )
+
+        # Статичные тексты и клавиатуры собираем один раз
+        contacts = self.knowledge_base['контакты']
+        self._schedule_text = f"📅 Расписание программ:\n\n{self.faq['Расписание программ']}"
+        self._tech_support_text = f"🔧 Техническая поддержка:\n\n{self.faq['Проблемы с качеством']}"
+        self._contacts_text = f"📞 Контакты:\n\nТелефон: {contacts['телефон']}\nEmail: {contacts['email']}\nСайт: {contacts['сайт']}"
+        self._faq_text = "📋 Часто задаваемые вопросы:\n\n" + "\n\n".join(f"❓ {q}\n✅ {a}" for q, a in self.faq.items())
+        self._help_text = """
+🤖 Команды бота DostyqTV:
+
+/start - Начать работу с ботом
+/help - Показать это сообщение
+/schedule - Программа передач
+/contact - Контактная информация
+/faq - Часто задаваемые вопросы
+/ticket - Создать обращение в поддержку
+/status - Проверить статус обращения
+
+💬 Вы также можете просто написать ваш вопрос, и я постараюсь помочь!
+        """
+
+        self._start_keyboard = InlineKeyboardMarkup([
+            [InlineKeyboardButton("📺 Программа передач", callback_data='schedule')],
+            [InlineKeyboardButton("🔧 Техническая поддержка", callback_data='tech_support')],
+            [InlineKeyboardButton("📞 Контакты", callback_data='contacts')],
+            [InlineKeyboardButton("📋 FAQ", callback_data='faq')]
+        ])
+        self._support_keyboard = InlineKeyboardMarkup([
+            [InlineKeyboardButton("📞 Связаться с поддержкой", callback_data='contacts')],
+            [InlineKeyboardButton("📋 Создать обращение", callback_data='create_ticket')]
+        ])
+
+        # Ответы на inline кнопки: callback_data -> (текст, клавиатура)
+        self._callback_dispatch: Dict[str, tuple] = {
+            'schedule': (self._schedule_text, None),
+            'tech_support': (self._tech_support_text, None),
+            'contacts': (self._contacts_text, None),
+            'faq': (self._faq_text, None)
+        }
+
+    @staticmethod
+    def normalize_query(text: str) -> str:
+        """Нижний регистр без знаков препинания"""
+        return re.sub(r'[^\w\s]', '', text.lower().strip())
+
+    def find_exact_answer(self, user_message: str) -> Optional[str]:
+        """Готовый ответ из FAQ при точном или близком совпадении вопроса"""
+        norm = self.normalize_query(user_message)
+        answer = self._exact_index.get(norm)
+        if answer is not None:
+            return answer
+
+        match = process.extractOne(norm, self._exact_keys, scorer=fuzz.token_sort_ratio, score_cutoff=85)
+        if match:
+            return self._exact_index[match[0]]
+        return None
+
     async def init_db(self):
         """Инициализация базы данных"""
-        conn = sqlite3.connect('dostyqtv_bot.db')
-        cursor = conn.cursor()
-
         # Таблица пользователей
-        cursor.execute('''
+        await self._db.execute('''
             CREATE TABLE IF NOT EXISTS users (
                 id INTEGER PRIMARY KEY,
                 username TEXT,
@@ -84,7 +399,7 @@ class DostyqTVBot:
         ''')
 
         # Таблица обращений
-        cursor.execute('''
+        await self._db.execute('''
             CREATE TABLE IF NOT EXISTS tickets (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 user_id INTEGER,
@@ -96,8 +411,12 @@ class DostyqTVBot:
             )
         ''')
 
+        # Индексы для статистики по обращениям
+        await self._db.execute('CREATE INDEX IF NOT EXISTS idx_tickets_status ON tickets(status)')
+        await self._db.execute('CREATE INDEX IF NOT EXISTS idx_tickets_created ON tickets(created_at)')
+
         # Таблица статистики
-        cursor.execute('''
+        await self._db.execute('''
             CREATE TABLE IF NOT EXISTS stats (
                 date DATE PRIMARY KEY,
                 users_count INTEGER DEFAULT 0,
@@ -106,42 +425,88 @@ class DostyqTVBot:
             )
         ''')
 
-        conn.commit()
-        conn.close()
+        await self._db.commit()
+
+        # WAL позволяет читать во время записи, synchronous=NORMAL убирает fsync на каждый commit
+        await self._db.execute('PRAGMA journal_mode=WAL')
+        await self._db.execute('PRAGMA synchronous=NORMAL')
+        await self._db.execute('PRAGMA temp_store=MEMORY')
+        await self._db.execute('PRAGMA mmap_size=67108864')
+        await self._db.execute('PRAGMA cache_size=-16000')
+
+    async def get_ai_response(self, user_message: str, user_context: Dict = None,
+                              on_partial: Optional[Callable[[str], None]] = None) -> str:
+        """Получение ответа от AI API Gemini. on_partial получает текст по мере генерации"""
+        # Вопросы из FAQ отвечаем сразу, без запроса к Gemini
+        answer = self.find_exact_answer(user_message)
+        if answer:
+            return answer
 
-    async def get_ai_response(self, user_message: str, user_context: Dict = None) -> str:
-        """Получение ответа от AI API Gemini"""
         if not self.GEMINI_API_KEY:
             logger.warning("GEMINI_API_KEY не найден. Используется резервный ответ.")
             return await self.get_fallback_response(user_message)
 
         try:
-            system_prompt = f"""
-            Ты - помощник службы поддержки телеканала DostyqTV. Отвечай на казахском или русском языке в зависимости от языка вопроса.
+            # Сначала ищем точное совпадение, затем семантически близкий запрос
+            cache_key = self.cache.make_key(user_message)
+            cached = await self.cache.get(cache_key)
+            if cached:
+                return cached
+
+            # Ошибка эмбеддинга не должна мешать основному запросу к Gemini
+            try:
+                embedding = await self._embed(user_message)
+            except Exception as e:
+                logger.error(f"Error with Gemini embedding: {e}")
+                embedding = None
+
+            if embedding is not None:
+                cached = self.cache.get_similar(embedding)
+                if cached:
+                    return cached
+
+            response = await self._call_gemini(user_message, self._system_prompt, on_partial)
+            if response is None:
+                return await self.get_fallback_response(user_message)
+
+            await self.cache.set(cache_key, embedding, response)
+            return response
 
-            База знаний:
-            {json.dumps(self.knowledge_base, ensure_ascii=False, indent=2)}
+        except Exception as e:
+            logger.error(f"Error with Gemini API: {e}")
+            return await self.get_fallback_response(user_message)
 
-            FAQ:
-            {json.dumps(self.faq, ensure_ascii=False, indent=2)}
+    async def _embed(self, text: str) -> Optional[np.ndarray]:
+        """Нормализованный эмбеддинг запроса через Gemini embedContent"""
+        url = f'https://generativelanguage.googleapis.com/v1beta/models/gemini-embedding-001:embedContent?key={self.GEMINI_API_KEY}'
 
-            Правила:
-            1. Всегда будь вежливым и профессиональным.
-            2. Если не знаешь точного ответа, предложи обратиться в службу поддержки, указав контакты.
-            3. Используй эмодзи для улучшения восприятия.
-            4. Ответы должны быть краткими, но информативными.
-            5. При технических проблемах предлагай пошаговые решения.
-            """
+        headers = {'Content-Type': 'application/json'}
 
-            return await self._call_gemini(user_message, system_prompt)
+        data = {
+            "model": "models/gemini-embedding-001",
+            "content": {
+                "parts": [{
+                    "text": text
+                }]
+            },
+            "outputDimensionality": 768
+        }
 
-        except Exception as e:
-            logger.error(f"Error with Gemini API: {e}")
-            return await self.get_fallback_response(user_message)
+        async with self._session.post(url, headers=headers, data=orjson.dumps(data)) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                logger.error(f"Gemini embedding error: {response.status}, {error_text}")
+                return None
+
+            result = orjson.loads(await response.read())
+            embedding = np.asarray(result['embedding']['values'], dtype=np.float32)
+            norm = np.linalg.norm(embedding)
+            return embedding / norm if norm else None
 
-    async def _call_gemini(self, user_message: str, system_prompt: str) -> str:
-        """Google Gemini API вызов"""
-        url = f'https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:generateContent?key={self.GEMINI_API_KEY}'
+    async def _call_gemini(self, user_message: str, system_prompt: str,
+                           on_partial: Optional[Callable[[str], None]] = None) -> Optional[str]:
+        """Google Gemini API вызов в режиме потока (SSE). Возвращает None при ошибке API"""
+        url = f'https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash-latest:streamGenerateContent?alt=sse&key={self.GEMINI_API_KEY}'
 
         headers = {'Content-Type': 'application/json'}
 
@@ -157,70 +522,94 @@ class DostyqTVBot:
             }
         }
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, headers=headers, json=data) as response:
-                if response.status == 200:
-                    result = await response.json()
-                    # Проверка на наличие контента в ответе
-                    if 'candidates' in result and result['candidates']:
-                        return result['candidates'][0]['content']['parts'][0]['text']
-                    else:
-                        logger.error(f"Gemini API response format error: {result}")
-                        return await self.get_fallback_response(user_message)
-                else:
-                    error_text = await response.text()
-                    logger.error(f"Gemini API error: {response.status}, {error_text}")
-                    return await self.get_fallback_response(user_message)
+        async with self._session.post(url, headers=headers, data=orjson.dumps(data)) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                logger.error(f"Gemini API error: {response.status}, {error_text}")
+                return None
+
+            # Каждое событие SSE содержит очередной фрагмент ответа
+            text = ''
+            result = None
+            async for line in response.content:
+                line = line.strip()
+                if not line.startswith(b'data:'):
+                    continue
+
+                result = orjson.loads(line[5:])
+                # Проверка на наличие контента в ответе
+                if 'candidates' not in result or not result['candidates']:
+                    continue
+
+                parts = result['candidates'][0].get('content', {}).get('parts', [])
+                chunk = ''.join(part.get('text', '') for part in parts)
+                if chunk:
+                    text += chunk
+                    if on_partial:
+                        on_partial(text)
+
+            if not text:
+                logger.error(f"Gemini API response format error: {result}")
+                return None
+            return text
 
     async def get_fallback_response(self, user_message: str) -> str:
         """Резервные ответы на основе ключевых слов"""
         message_lower = user_message.lower()
 
-        # Поиск по ключевым словам
-        if any(word in message_lower for word in ['программа', 'расписание', 'передач']):
-            return "📺 Полное расписание программ доступно на сайте dostyq.tv в разделе 'Каталог'"
-
-        elif any(word in message_lower for word in ['качество', 'плохо', 'тормозит', 'зависает']):
-            return "🔧 При проблемах с качеством, попробуйте перезагрузить приставку. Если не помогло, свяжитесь с поддержкой: +7 771 300 05 02, +7 702 300 05 01"
-
-        elif any(word in message_lower for word in ['настроить', 'канал', 'найти']):
-            return "⚙️ Настройка канала DostyqTV:\n\n📍 Найдите нас на позиции 44 в кабельных сетях. Если не получается, обратитесь к вашему оператору кабельного ТВ."
-
-        elif any(word in message_lower for word in ['контакт', 'телефон', 'связаться']):
-            return "📞 Контакты DostyqTV:\n\n☎️ Поддержка: +7 777 013 3812\n📧 Email: support@dostyq.tv\n🌐 Сайт: https://dostyq.tv"
+        # Правила проверяются по порядку, побеждает первое совпадение
+        for pattern, response in self._fallback_rules:
+            if pattern.search(message_lower):
+                return response
 
-        elif any(word in message_lower for word in ['реклама', 'размещение']):
-            return "📢 По вопросам размещения рекламы:\n\n📧 reklama@dostyq.tv\n☎️ +7 (727) 24-24-25"
-
-        else:
-            return "👋 Здравствуйте! Я помогу вам с вопросами по телеканалу DostyqTV.\n\n🔍 Используйте /help для просмотра доступных команд или просто опишите вашу проблему."
+        return self._fallback_default
 
     async def save_user(self, user):
-        """Сохранение информации о пользователе"""
-        conn = sqlite3.connect('dostyqtv_bot.db')
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            INSERT OR REPLACE INTO users (id, username, first_name, last_name, last_activity)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (user.id, user.username, user.first_name, user.last_name, datetime.now()))
+        """Сохранение информации о пользователе (в фоне, через очередь записи)"""
+        self._write_queue.put_nowait((user.id, user.username, user.first_name, user.last_name))
 
-        conn.commit()
-        conn.close()
+    async def user_writer(self):
+        """Фоновая запись пользователей пачками: до 100 строк или раз в 200 мс"""
+        loop = asyncio.get_running_loop()
+        batch = []
+        try:
+            while True:
+                batch = [await self._write_queue.get()]
+                deadline = loop.time() + self.WRITE_BATCH_INTERVAL
+
+                while len(batch) < self.WRITE_BATCH_SIZE:
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._write_queue.get(), timeout=remaining))
+                    except asyncio.TimeoutError:
+                        break
+
+                await self._flush_users(batch)
+                batch = []
+        except asyncio.CancelledError:
+            # При остановке дописываем текущую пачку и остаток очереди
+            while not self._write_queue.empty():
+                batch.append(self._write_queue.get_nowait())
+            if batch:
+                await self._flush_users(batch)
+            raise
+
+    async def _flush_users(self, batch: List[tuple]):
+        try:
+            await self._db.executemany(SQL_UPSERT_USER, batch)
+            await self._db.commit()
+        except Exception as e:
+            logger.error(f"Error saving users: {e}")
 
     async def create_ticket(self, user_id: int, message: str, category: str = 'general'):
         """Создание тикета"""
-        conn = sqlite3.connect('dostyqtv_bot.db')
-        cursor = conn.cursor()
-
-        cursor.execute('''
-            INSERT INTO tickets (user_id, message, category)
-            VALUES (?, ?, ?)
-        ''', (user_id, message, category))
+        cursor = await self._db.execute(SQL_INSERT_TICKET, (user_id, message, category))
 
         ticket_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        await cursor.close()
+        await self._db.commit()
 
         return ticket_id
 
@@ -243,59 +632,23 @@ class DostyqTVBot:
 💡 Просто напишите ваш вопрос или используйте команды ниже:
         """
 
-        keyboard = [
-            [InlineKeyboardButton("📺 Программа передач", callback_data='schedule')],
-            [InlineKeyboardButton("🔧 Техническая поддержка", callback_data='tech_support')],
-            [InlineKeyboardButton("📞 Контакты", callback_data='contacts')],
-            [InlineKeyboardButton("📋 FAQ", callback_data='faq')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-
-        await update.message.reply_text(welcome_message, reply_markup=reply_markup)
+        await update.message.reply_text(welcome_message, reply_markup=self._start_keyboard)
 
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /help"""
-        help_text = """
-🤖 Команды бота DostyqTV:
-
-/start - Начать работу с ботом
-/help - Показать это сообщение
-/schedule - Программа передач
-/contact - Контактная информация
-/faq - Часто задаваемые вопросы
-/ticket - Создать обращение в поддержку
-/status - Проверить статус обращения
-
-💬 Вы также можете просто написать ваш вопрос, и я постараюсь помочь!
-        """
-
-        await update.message.reply_text(help_text)
+        await update.message.reply_text(self._help_text)
 
     async def handle_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик inline кнопок"""
         query = update.callback_query
         await query.answer()
 
-        data = query.data
-
-        if data == 'schedule':
-            schedule_text = self.faq['Расписание программ']
-            await query.edit_message_text(f"📅 Расписание программ:\n\n{schedule_text}")
+        text_markup = self._callback_dispatch.get(query.data)
+        if text_markup:
+            text, reply_markup = text_markup
+            await query.edit_message_text(text, reply_markup=reply_markup)
 
-        elif data == 'tech_support':
-            tech_text = self.faq['Проблемы с качеством']
-            await query.edit_message_text(f"🔧 Техническая поддержка:\n\n{tech_text}")
-
-        elif data == 'contacts':
-            contacts_text = f"📞 Контакты:\n\nТелефон: {self.knowledge_base['контакты']['телефон']}\nEmail: {self.knowledge_base['контакты']['email']}\nСайт: {self.knowledge_base['контакты']['сайт']}"
-            await query.edit_message_text(contacts_text)
-
-        elif data == 'faq':
-            faq_items = [f"❓ {q}\n✅ {a}" for q, a in self.faq.items()]
-            faq_text = "\n\n".join(faq_items)
-            await query.edit_message_text(f"📋 Часто задаваемые вопросы:\n\n{faq_text}")
-
-        elif data == 'create_ticket':
+        elif query.data == 'create_ticket':
             await self.ticket_command(update, context)
 
 
@@ -309,17 +662,49 @@ class DostyqTVBot:
         # Показываем индикатор печатания
         await context.bot.send_chat_action(chat_id=update.effective_chat.id, action='typing')
 
+        reply = None
+        latest_text = ''
+        last_push = 0.0
+        push_task: Optional[asyncio.Task] = None
+
+        async def push_partial():
+            # Отправляем последний накопленный текст; чтение потока Gemini при этом не ждет
+            nonlocal reply
+            try:
+                if reply is None:
+                    reply = await update.message.reply_text(latest_text)
+                else:
+                    await reply.edit_text(latest_text)
+            except TelegramError as e:
+                logger.warning(f"Error updating streamed reply: {e}")
+
+        def show_partial(text: str):
+            # Не чаще STREAM_EDIT_INTERVAL и не больше одной правки одновременно
+            nonlocal latest_text, last_push, push_task
+            latest_text = text
+            now = time.monotonic()
+            if (push_task and not push_task.done()) or now - last_push < self.STREAM_EDIT_INTERVAL:
+                return
+            last_push = now
+            push_task = asyncio.create_task(push_partial())
+
+        # Потоковый вывод только в личных чатах: в группах Telegram допускает 20 сообщений в минуту
+        stream = update.effective_chat.type == ChatType.PRIVATE
+
         # Получаем ответ от AI или fallback
-        response = await self.get_ai_response(user_message)
+        response = await self.get_ai_response(user_message, on_partial=show_partial if stream else None)
 
-        # Добавляем кнопки быстрых действий
-        keyboard = [
-            [InlineKeyboardButton("📞 Связаться с поддержкой", callback_data='contacts')],
-            [InlineKeyboardButton("📋 Создать обращение", callback_data='create_ticket')]
-        ]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        # Дожидаемся последней правки, чтобы она не перезаписала итоговый ответ
+        if push_task:
+            await push_task
 
-        await update.message.reply_text(response, reply_markup=reply_markup, parse_mode=ParseMode.MARKDOWN)
+        parse_mode = None if response in self._canned_responses else ParseMode.MARKDOWN
+
+        # Добавляем кнопки быстрых действий
+        if reply is None:
+            await update.message.reply_text(response, reply_markup=self._support_keyboard, parse_mode=parse_mode)
+        else:
+            await reply.edit_text(response, reply_markup=self._support_keyboard, parse_mode=parse_mode)
 
     async def ticket_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Команда создания тикета"""
@@ -350,18 +735,9 @@ class DostyqTVBot:
             await update.message.reply_text("❌ У вас нет прав для просмотра статистики")
             return
 
-        conn = sqlite3.connect('dostyqtv_bot.db')
-        cursor = conn.cursor()
-
-        # Общая статистика
-        cursor.execute('SELECT COUNT(*) FROM users')
-        total_users = cursor.fetchone()[0]
-
-        cursor.execute('SELECT COUNT(*) FROM tickets WHERE status = "open"')
-        open_tickets = cursor.fetchone()[0]
-
-        cursor.execute('SELECT COUNT(*) FROM tickets WHERE date(created_at) = date("now")')
-        today_tickets = cursor.fetchone()[0]
+        # Общая статистика одним запросом
+        async with self._db.execute(SQL_STATS) as cursor:
+            total_users, open_tickets, today_tickets = await cursor.fetchone()
 
         stats_text = f"""
 📊 Статистика DostyqTV Bot:
@@ -373,7 +749,6 @@ class DostyqTVBot:
 📅 Дата: {datetime.now().strftime('%d.%m.%Y %H:%M')}
         """
 
-        conn.close()
         await update.message.reply_text(stats_text)
 
     def setup_handlers(self, application):
@@ -388,7 +763,8 @@ class DostyqTVBot:
         application.add_handler(CallbackQueryHandler(self.handle_callback))
 
         # Текстовые сообщения
-        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
+        # block=False: долгий ответ Gemini не задерживает обработку других обновлений
+        application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message, block=False))
 
     async def set_bot_commands(self, application):
         """Установка команд бота"""
@@ -406,9 +782,29 @@ class DostyqTVBot:
     # ИЗМЕНЕНИЕ 1: Создаем новую асинхронную функцию для задач, которые нужно выполнить ДО запуска бота
     async def post_init(self, application: Application):
         """Задачи, выполняемые после инициализации приложения, но до запуска опроса."""
+        # Пул соединений переиспользует TCP/TLS соединения к Gemini между запросами
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=50, limit_per_host=20, keepalive_timeout=75, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=30)
+        )
+        self._db = await aiosqlite.connect('dostyqtv_bot.db', cached_statements=256)
         await self.init_db()
+        self._writer_task = asyncio.create_task(self.user_writer())
+        await self.cache.load()
         await self.set_bot_commands(application)
 
+    async def post_shutdown(self, application: Application):
+        """Освобождение ресурсов после остановки бота."""
+        if self._session:
+            await self._session.close()
+        if self._writer_task:
+            self._writer_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._writer_task
+        if self._db:
+            await self._db.close()
+        await self.cache.close()
+
     def run(self):
         """Запуск бота"""
         if not self.BOT_TOKEN:
@@ -422,7 +818,16 @@ class DostyqTVBot:
         application = (
             Application.builder()
             .token(self.BOT_TOKEN)
+            # Ограничение Telegram: ~30 сообщений в секунду на бота
+            .rate_limiter(AIORateLimiter(overall_max_rate=30, overall_time_period=1, max_retries=3))
+            .concurrent_updates(True)
+            .connection_pool_size(256)
+            .pool_timeout(30)
+            .connect_timeout(20)
+            .read_timeout(20)
+            .get_updates_pool_timeout(30)
             .post_init(self.post_init)
+            .post_shutdown(self.post_shutdown)
             .build()
         )
 
@@ -436,6 +841,13 @@ class DostyqTVBot:
 
 
 if __name__ == '__main__':
+    # uvloop быстрее стандартного цикла событий, но недоступен на Windows
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        logger.info("uvloop не установлен, используется стандартный цикл событий asyncio")
+
     bot = DostyqTVBot()
     # ИЗМЕНЕНИЕ 4: Убираем `asyncio.run()`. Просто вызываем синхронный метод `run`.
     bot.run()
\ No newline at end of file